@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible extraction benchmarks over synthetic GeoTIFF stacks.
+
+For each combination of image size, block layout (tiled or striped) and compression, NDVI/EVI
+time series stacks, a DOY stack, a time line CSV and samples CSVs are generated with GDAL's MEM and
+GTiff drivers. MyTCSV.fetch_data, Timeline.read_pixel_dates, Mygdal.geolocs_to_pixels,
+Mygdal.reproject_geolocs_from and Samples.get_samples_timeseries are then timed for every samples count.
+Each result is printed as a JSON line with its throughput, the peak of memory allocated by its function
+(traced by tracemalloc in one extra untimed run, so GDAL's own allocations are left out) and the peak
+RSS of the child process running every benchmark of its samples count, each count getting a new process.
+With --check, the time series read through the stacks VRT (use_vrt) are also verified to be the same
+as the ones read stack by stack, and the script fails otherwise.
+
+    python gdal_benchmark.py --sizes 1024x1024 --samples 1000,100000,1000000
+"""
+from osgeo import osr, gdal
+from mygdal import Samples, get_coordinate_transformation
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy
+
+BANDS = ('ndvi', 'evi')
+NODATA = -3000
+DOY_NODATA = -1
+SAMPLES_EPSG = 4326
+IMAGE_EPSG = 32723
+IMAGE_UL = (500000.0, 8000000.0)
+IMAGE_RESOLUTION = 30.0
+TIMELINE_START = datetime.date(2015, 1, 1)
+TIMELINE_STEP = 16
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of this process so far, in kilobytes (macOS reports it in bytes).
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def get_srs_wkt(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+
+def write_stack(filename, arrays, nodata, layout, compress, block_size):
+    """
+    Builds a stack in memory with the MEM driver and copies it to a GTiff file with the given layout
+    ('tiled' or 'striped') and compression ('NONE', 'DEFLATE', 'LZW'...).
+    """
+    times, height, width = arrays.shape
+    mem = gdal.GetDriverByName('MEM').Create('', width, height, times, gdal.GDT_Int16)
+    mem.SetGeoTransform((IMAGE_UL[0], IMAGE_RESOLUTION, 0.0, IMAGE_UL[1], 0.0, -IMAGE_RESOLUTION))
+    mem.SetProjection(get_srs_wkt(IMAGE_EPSG))
+    for i in range(times):
+        band = mem.GetRasterBand(i + 1)
+        band.SetNoDataValue(nodata)
+        band.WriteArray(arrays[i])
+    options = ['COMPRESS=%s' % compress, 'INTERLEAVE=PIXEL']
+    if layout == 'tiled':
+        options += ['TILED=YES', 'BLOCKXSIZE=%d' % block_size, 'BLOCKYSIZE=%d' % block_size]
+    else:
+        options += ['TILED=NO', 'BLOCKYSIZE=1']
+    gdal.GetDriverByName('GTiff').CreateCopy(filename, mem, options=options)
+
+
+def write_stacks(directory, width, height, times, layout, compress, block_size, rng):
+    """
+    Writes the bands stacks, the DOY stack and the time line CSV of a synthetic scene.
+    Returns the time line CSV path and the bands paths.
+    """
+    bands_files = []
+    for name in BANDS:
+        values = rng.integers(-2000, 10000, (times, height, width), dtype=numpy.int16)
+        values[rng.random(values.shape) < 0.05] = NODATA
+        bands_files.append(os.path.join(directory, '%s.tif' % name))
+        write_stack(bands_files[-1], values, NODATA, layout, compress, block_size)
+    dates = [TIMELINE_START + datetime.timedelta(days=TIMELINE_STEP * i) for i in range(times)]
+    doys = numpy.array([(date - datetime.date(date.year, 1, 1)).days + 1 for date in dates], dtype=numpy.int16)
+    doys = numpy.broadcast_to(doys[:, None, None], (times, height, width)) + \
+        rng.integers(0, TIMELINE_STEP, (times, height, width), dtype=numpy.int16)
+    doys[rng.random(doys.shape) < 0.05] = DOY_NODATA
+    doy_file = os.path.join(directory, 'doy.tif')
+    write_stack(doy_file, doys, DOY_NODATA, layout, compress, block_size)
+    timeline_file = os.path.join(directory, 'timeline.csv')
+    with open(timeline_file, 'w') as file:
+        file.write('#has_header=True\n#date_field=date\n#date_format=%%Y-%%m-%%d\n#doy_tif_filepath=%s\n'
+                   '#doy_factor=1\ndate\n' % doy_file)
+        file.writelines('%s\n' % date.isoformat() for date in dates)
+    return timeline_file, bands_files
+
+
+def write_samples(filename, n, width, height, timeline_file, bands_files, rng):
+    """
+    Writes a samples CSV with @n random points inside the scene, given in geographic coordinates
+    so that extraction includes a real reprojection.
+    """
+    pixels = rng.random((n, 2)) * (width, height)
+    geolocs = numpy.array(IMAGE_UL) + pixels * (IMAGE_RESOLUTION, -IMAGE_RESOLUTION)
+    samples_wkt = get_srs_wkt(SAMPLES_EPSG)
+    geolocs = numpy.array(get_coordinate_transformation(get_srs_wkt(IMAGE_EPSG), samples_wkt)
+                          .TransformPoints(geolocs))[:, 0:2]
+    classes = rng.choice(['forest', 'pasture', 'soy'], n)
+    with open(filename, 'w') as file:
+        file.write('#has_header=True\n#x_field=x\n#y_field=y\n#projection_wkt=%s\n#from_date_field=from\n'
+                   '#to_date_field=to\n#date_format=%%Y-%%m-%%d\n#class_field=class\n#timeline_filepath=%s\n'
+                   '#bands_filepaths=%s\n#bands_factors=%s\nx,y,from,to,class\n' %
+                   (samples_wkt, timeline_file, ','.join(bands_files), ','.join(['0.0001'] * len(bands_files))))
+        for (x, y), label in zip(geolocs, classes):
+            file.write('%r,%r,2015-03-01,2015-11-30,%s\n' % (float(x), float(y), label))
+
+
+def run(name, function, items, repeat, scene, setup=None):
+    """
+    Times @function (best of @repeat runs), then traces the memory it allocates in one more run.
+    If @setup is given, it is called before each run, neither timed nor traced, and its result is
+    given to @function. Returns the result record.
+    """
+    seconds = None
+    for _ in range(repeat):
+        args = (setup(),) if setup else ()
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    args = (setup(),) if setup else ()
+    tracemalloc.start()
+    try:
+        function(*args)
+        peak_alloc = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(scene, benchmark=name, items=items, seconds=seconds,
+                throughput=items / seconds if seconds else None, peak_alloc_kb=peak_alloc // 1024)
+
+
+def benchmark_samples(samples_file, n, repeat, scene):
+    """
+    Runs every benchmark over a samples file. Returns the list of result records, with the peak RSS of
+    this process once they are all run. It is meant to run in its own process (see main()).
+    """
+    result = [run('MyTCSV.fetch_data', Samples.fetch_data, n, 1, scene, lambda: Samples(samples_file))]
+    samples = Samples(samples_file)
+    samples.fetch_data()
+    doy_stack = samples.timeline.doy_stack
+    geolocs = samples.read_samples_geolocs()
+    projection = samples.tags[Samples.TAG_PROJ_WKT]
+    result.append(run('Mygdal.reproject_geolocs_from',
+                      lambda: doy_stack.reproject_geolocs_from(geolocs, projection), n, repeat, scene))
+    geolocs = doy_stack.reproject_geolocs_from(geolocs, projection)
+    result.append(run('Mygdal.geolocs_to_pixels', lambda: doy_stack.geolocs_to_pixels(geolocs), n, repeat, scene))
+    pixels = doy_stack.geolocs_to_pixels(geolocs)
+    pixels_subset = pixels[:min(n, 10000)]
+    result.append(run('Timeline.read_pixel_dates',
+                      lambda: [samples.timeline.read_pixel_dates(pixel) for pixel in pixels_subset],
+                      len(pixels_subset), repeat, scene))
+    result.append(run('Timeline.read_pixels_dates', lambda: samples.timeline.read_pixels_dates(pixels),
+                      n, repeat, scene))
+    result.append(run('Samples.get_samples_timeseries', samples.get_samples_timeseries, n, repeat, scene))
+    samples.close()
+    peak_rss = get_peak_rss()
+    return [dict(record, peak_rss_kb=peak_rss) for record in result]
+
+
+def same_timeseries(timeseries, other):
+    """
+    Tells whether two get_samples_timeseries() results are the same, values types included.
+    """
+    if isinstance(timeseries, numpy.ndarray):
+        return (isinstance(other, numpy.ndarray) and timeseries.dtype == other.dtype and
+                numpy.array_equal(timeseries, other))
+    if isinstance(timeseries, list):
+        return (isinstance(other, list) and len(timeseries) == len(other) and
+                all(same_timeseries(value, other_value) for value, other_value in zip(timeseries, other)))
+    return timeseries == other
+
+
+def check_samples(samples_file, scene):
+    """
+    Verifies that a samples file time series are the same when read through the stacks VRT and stack by
+    stack, with and without the samples interval filter. Returns the check record or raises AssertionError.
+    """
+    result = []
+    for use_vrt in (False, True):
+        samples = Samples(samples_file, use_vrt=use_vrt)
+        samples.fetch_data()
+        result.append([samples.get_samples_timeseries(filter_sample_interval=value) for value in (False, True)])
+        samples.close()
+    if not same_timeseries(*result):
+        raise AssertionError('use_vrt time series differ from stack by stack ones for %s' % samples_file)
+    return dict(scene, check='use_vrt', equal=True)
+
+
+def parse_sizes(value):
+    return [tuple(int(size) for size in item.split('x')) for item in value.split(',')]
+
+
+def parse_ints(value):
+    return [int(item) for item in value.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks samples extraction over synthetic GeoTIFF stacks.')
+    parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('1024x1024'),
+                        help='comma separated WIDTHxHEIGHT image sizes (default: 1024x1024)')
+    parser.add_argument('--times', type=int, default=23, help='time line length (default: 23)')
+    parser.add_argument('--samples', type=parse_ints, default=parse_ints('1000,100000,1000000'),
+                        help='comma separated samples counts (default: 1000,100000,1000000)')
+    parser.add_argument('--layouts', default='tiled,striped', help='comma separated block layouts')
+    parser.add_argument('--compress', default='NONE,DEFLATE', help='comma separated GTiff compressions')
+    parser.add_argument('--block-size', type=int, default=256, help='tile size of tiled layouts (default: 256)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best is kept (default: 3)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of synthetic data (default: 0)')
+    parser.add_argument('--workdir', help='directory of generated files (default: a removed temporary directory)')
+    parser.add_argument('--output', help='JSON lines output file (default: standard output)')
+    parser.add_argument('--check', action='store_true',
+                        help='also verify that use_vrt reads give the same time series as stack by stack reads')
+    args = parser.parse_args()
+    directory = args.workdir or tempfile.mkdtemp(prefix='mygdal_benchmark_')
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for width, height in args.sizes:
+            for layout in args.layouts.split(','):
+                for compress in args.compress.split(','):
+                    rng = numpy.random.default_rng(args.seed)
+                    scene_directory = os.path.join(directory, '%dx%d_%s_%s' % (width, height, layout, compress))
+                    os.makedirs(scene_directory, exist_ok=True)
+                    timeline_file, bands_files = write_stacks(scene_directory, width, height, args.times, layout,
+                                                              compress, args.block_size, rng)
+                    scene = {'width': width, 'height': height, 'times': args.times, 'layout': layout,
+                             'compress': compress}
+                    for n in args.samples:
+                        samples_file = os.path.join(scene_directory, 'samples_%d.csv' % n)
+                        write_samples(samples_file, n, width, height, timeline_file, bands_files, rng)
+                        with multiprocessing.get_context('spawn').Pool(1) as pool:
+                            records = pool.apply(benchmark_samples, (samples_file, n, args.repeat,
+                                                                     dict(scene, samples=n)))
+                        for record in records:
+                            print(json.dumps(record), file=output, flush=True)
+                        if args.check:
+                            print(json.dumps(check_samples(samples_file, dict(scene, samples=n))), file=output,
+                                  flush=True)
+    finally:
+        if output:
+            output.close()
+        if not args.workdir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
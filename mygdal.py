@@ -1,6 +1,15 @@
 # -*- coding: utf-8 -*-
 
-from osgeo import osr, gdal
+from osgeo import osr, gdal, gdal_array
+from xml.sax.saxutils import escape
+import collections
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import threading
+import time
 import numpy
 import datetime
 
@@ -20,6 +29,112 @@ __error_invalid_bbox__ = 'InvalidBoundBox'
 __error_invalid_bbox_msg__ = 'Invalid bound box.'
 __error_bands_tags__ = 'BandsTagsError'
 __error_bands_tags_msg__ = 'bands_paths and bands_factors tags must have the same length.'
+__error_stacks_grid__ = 'DiffStacksGrid'
+__error_stacks_grid_msg__ = 'The tif stack %s grid (size, geotransform or projection) is different of %s\'s.'
+__error_resample_method__ = 'InvalidResampleMethod'
+__error_resample_method_msg__ = 'Resample method \'%s\' is not one of %s.'
+__error_no_valid_pixels__ = 'NoValidPixels'
+__error_no_valid_pixels_msg__ = 'Only %s of %s valid pixels were found in %s random draws.'
+
+
+__instruments__ = None
+__transformations__ = threading.local()
+
+
+class Instruments:
+    """
+    Opt-in instrumentation of the extraction process: per stage timers (csv fetching, reprojection, pixel
+    conversion, reads and date reconstruction), per dataset read counters (GDAL read calls, bytes and pixels)
+    and hooks receiving every measure as it happens, e.g. to export them to a metrics system.
+    Instruments are enabled by enable_instruments() and only measure this process, not multiprocess workers.
+    """
+    STAGE = 'stage'
+    READ = 'read'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        """
+        Registers a callable called as hook(kind, name, measures) for every measure, where @kind is
+        Instruments.STAGE (@name is the stage, @measures has its seconds) or Instruments.READ (@name is
+        the dataset name, @measures has bytes and pixels read).
+        :param hook: callable
+        """
+        self.hooks.append(hook)
+
+    def add_time(self, stage, seconds):
+        with self.lock:
+            timer = self.timers.setdefault(stage, {'calls': 0, 'seconds': 0.0})
+            timer['calls'] += 1
+            timer['seconds'] += seconds
+        for hook in self.hooks:
+            hook(Instruments.STAGE, stage, {'seconds': seconds})
+
+    def add_read(self, dataset, values):
+        measures = {'bytes': values.nbytes, 'pixels': values.size // len(values) if len(values) else 0}
+        with self.lock:
+            counter = self.counters.setdefault(dataset, {'reads': 0, 'bytes': 0, 'pixels': 0})
+            counter['reads'] += 1
+            counter['bytes'] += measures['bytes']
+            counter['pixels'] += measures['pixels']
+        for hook in self.hooks:
+            hook(Instruments.READ, dataset, measures)
+
+    def reset(self):
+        with self.lock:
+            self.timers = {}
+            self.counters = {}
+
+    def get_stats(self):
+        with self.lock:
+            return {'timers': {key: dict(value) for key, value in self.timers.items()},
+                    'counters': {key: dict(value) for key, value in self.counters.items()}}
+
+
+def enable_instruments(instruments=None):
+    """
+    Enables the instrumentation of this module with @instruments, or a new Instruments object if None.
+    :param instruments: Instruments
+    :return: Instruments
+    """
+    global __instruments__
+    __instruments__ = instruments if instruments is not None else Instruments()
+    return __instruments__
+
+
+def disable_instruments():
+    global __instruments__
+    __instruments__ = None
+
+
+def get_instruments():
+    return __instruments__
+
+
+def timed_stage(stage):
+    """
+    Decorates a function to add its running time to @stage timer while instruments are enabled.
+    When they are disabled it only costs a global lookup per call.
+    :param stage: string
+    :return: function
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if __instruments__ is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if __instruments__ is not None:
+                    __instruments__.add_time(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
 
 
 def ord_pair(i, j):
@@ -32,10 +147,273 @@ def to_float(value, decimal):
     return float(value)
 
 
+@functools.lru_cache(maxsize=4096)
 def to_date(value, date_format):
     return datetime.datetime.strptime(value, date_format)
 
 
+def get_coordinate_transformation(srs_wkt_from, srs_wkt_to):
+    """
+    Returns a cached transformation between two systems of reference, or None if they are the same.
+    Transformations are cached per thread, as GDAL transformations must not be used by two threads at once.
+    :param srs_wkt_from: string
+    :param srs_wkt_to: string
+    :return: osr.CoordinateTransformation
+    """
+    cache = getattr(__transformations__, 'cache', None)
+    if cache is None:
+        cache = __transformations__.cache = functools.lru_cache(maxsize=64)(new_coordinate_transformation)
+    return cache(srs_wkt_from, srs_wkt_to)
+
+
+def new_coordinate_transformation(srs_wkt_from, srs_wkt_to):
+    """
+    Returns a new transformation between two systems of reference, or None if they are the same.
+    :param srs_wkt_from: string
+    :param srs_wkt_to: string
+    :return: osr.CoordinateTransformation
+    """
+    srs_from = osr.SpatialReference()
+    srs_from.ImportFromWkt(srs_wkt_from)
+    srs_to = osr.SpatialReference()
+    srs_to.ImportFromWkt(srs_wkt_to)
+    if srs_wkt_from == srs_wkt_to or srs_from.IsSame(srs_to):
+        return None
+    return osr.CoordinateTransformation(srs_from, srs_to)
+
+
+def get_file_key(filename):
+    """
+    Returns a key that changes whenever @filename is modified, made of its absolute path, modification time and size.
+    Files that cannot be stat'ed (e.g. GDAL virtual file systems) are identified by their name only.
+    :param filename: string
+    :return: string
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return filename
+    return '%s|%d|%d' % (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+class BlockCache:
+    """
+    In-process LRU cache of image blocks shared by any number of Mygdal objects.
+    Blocks are keyed by (filename, bands range, block x, block y) and the least recently
+    used ones are evicted whenever the cached blocks exceed @max_bytes. It is thread safe.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.blocks = collections.OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value = self.blocks[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            if key in self.blocks:
+                self.bytes -= self.blocks.pop(key).nbytes
+            if value.nbytes > self.max_bytes:
+                return
+            while self.blocks and self.bytes + value.nbytes > self.max_bytes:
+                self.bytes -= self.blocks.popitem(last=False)[1].nbytes
+            self.blocks[key] = value
+            self.bytes += value.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        requests = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / requests if requests else 0.0,
+                'blocks': len(self.blocks), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+
+class DatasetPool:
+    """
+    Bounded pool of open GDAL datasets shared by any number of Mygdal objects. Datasets are opened on first
+    use and the least recently used ones are closed whenever more than @max_open are open. A dataset closed
+    by the pool while it is being read is released at the end of the read. It is thread safe: each dataset
+    comes with its own lock, which Mygdal objects sharing it hold while reading it, and files are opened
+    without holding the pool lock, so a slow open does not delay other datasets.
+    """
+
+    def __init__(self, max_open=64):
+        self.lock = threading.Lock()
+        self.max_open = max_open
+        self.opens = 0
+        self.datasets = collections.OrderedDict()
+
+    def get(self, filename):
+        return self.get_entry(filename)[0]
+
+    def get_entry(self, filename):
+        """
+        Returns the open dataset of @filename and the lock to hold while reading it.
+        :param filename: string
+        :return: tuple
+        """
+        with self.lock:
+            result = self.datasets.get(filename)
+            if result is not None:
+                self.datasets.move_to_end(filename)
+                return result
+        dataset = Mygdal.open_dataset(filename)
+        with self.lock:
+            result = self.datasets.get(filename)
+            if result is not None:
+                self.datasets.move_to_end(filename)
+                return result
+            result = (dataset, threading.Lock())
+            self.opens += 1
+            self.datasets[filename] = result
+            while len(self.datasets) > self.max_open:
+                self.datasets.popitem(last=False)
+            return result
+
+    def close(self, filename):
+        with self.lock:
+            self.datasets.pop(filename, None)
+
+    def close_all(self):
+        with self.lock:
+            self.datasets.clear()
+
+
+class SpatialIndex:
+    """
+    Grid index of pixels bucketed by the image block they fall in. Buckets are kept in block storage order
+    (row by row) and pixels inside each bucket row by row too, so walking the index reads the image sequentially.
+    Queries return indexes of the pixels given at construction.
+    """
+
+    def __init__(self, pixels, block_size):
+        self.pixels = numpy.reshape(numpy.array(pixels, dtype=numpy.dtype(int)), (-1, 2))
+        self.block_size = numpy.array(block_size, dtype=numpy.dtype(int))
+        blocks = self.pixels // self.block_size
+        self.order = numpy.lexsort((self.pixels[:, Mygdal.GT_X], self.pixels[:, Mygdal.GT_Y],
+                                    blocks[:, Mygdal.GT_X], blocks[:, Mygdal.GT_Y]))
+        blocks = blocks[self.order]
+        starts = numpy.flatnonzero(numpy.any(blocks[1:] != blocks[:-1], axis=1)) + 1
+        self.buckets_start = numpy.concatenate(([0], starts)) if len(blocks) else starts
+        self.buckets_end = numpy.append(starts, len(blocks))[:len(self.buckets_start)]
+        self.buckets = {(int(block[Mygdal.GT_X]), int(block[Mygdal.GT_Y])): (start, end) for block, start, end
+                        in zip(blocks[self.buckets_start], self.buckets_start, self.buckets_end)}
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def iter_buckets(self):
+        """
+        Iterates over non empty buckets in storage order, yielding each block (x, y) and its pixels indexes.
+        :return: generator
+        """
+        for block, (start, end) in self.buckets.items():
+            yield block, self.order[start:end]
+
+    def query_block(self, block_x, block_y):
+        start, end = self.buckets.get((int(block_x), int(block_y)), (0, 0))
+        return self.order[start:end]
+
+    def query_bbox(self, bbox_ul, bbox_lr):
+        """
+        Returns the sorted indexes of the pixels p such that @bbox_ul <= p < @bbox_lr.
+        Only the buckets overlapping the bound box are visited.
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :return: numpy.array
+        """
+        bbox_ul = numpy.array(bbox_ul, dtype=numpy.dtype(int))
+        bbox_lr = numpy.array(bbox_lr, dtype=numpy.dtype(int))
+        if numpy.any(bbox_ul >= bbox_lr):
+            return numpy.array([], dtype=numpy.dtype(int))
+        blocks_ul = bbox_ul // self.block_size
+        blocks_lr = (bbox_lr - 1) // self.block_size
+        blocks_count = numpy.prod(blocks_lr - blocks_ul + 1)
+        if blocks_count <= len(self.buckets):
+            candidates = [self.query_block(block_x, block_y)
+                          for block_y in range(blocks_ul[Mygdal.GT_Y], blocks_lr[Mygdal.GT_Y] + 1)
+                          for block_x in range(blocks_ul[Mygdal.GT_X], blocks_lr[Mygdal.GT_X] + 1)]
+        else:
+            candidates = [indexes for block, indexes in self.iter_buckets()
+                          if numpy.all(block >= blocks_ul) and numpy.all(block <= blocks_lr)]
+        candidates = numpy.concatenate(candidates) if candidates else numpy.array([], dtype=numpy.dtype(int))
+        pixels = self.pixels[candidates]
+        return numpy.sort(candidates[numpy.all((pixels >= bbox_ul) & (pixels < bbox_lr), axis=1)])
+
+    def query_radius(self, center, radius):
+        """
+        Returns the sorted indexes of the pixels whose distance to @center is at most @radius (in pixels).
+        :param center: numpy.array
+        :param radius: float
+        :return: numpy.array
+        """
+        center = numpy.array(center)
+        candidates = self.query_bbox(numpy.floor(center - radius), numpy.floor(center + radius) + 1)
+        distances = numpy.sum((self.pixels[candidates] - center) ** 2, axis=1)
+        return candidates[distances <= radius ** 2]
+
+
+class SamplesCube:
+    """
+    Dense time series of a set of samples: a float32 (samples, bands, time) values cube with bands factors
+    applied, a boolean (samples, bands, time) validity mask and a datetime64 (samples, time) dates matrix.
+    Row i of every array belongs to sample samples_index[i]. If the cube was built grouped by a field,
+    the samples of each key are contiguous and groups maps each key to its rows slice.
+    """
+
+    def __init__(self, values, mask, dates, samples_index, groups=None):
+        self.values = values
+        self.mask = mask
+        self.dates = dates
+        self.samples_index = samples_index
+        self.groups = groups if groups is not None else {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def get_group(self, key):
+        """
+        Returns the samples of a group key as a new cube whose arrays are views of this cube's ones.
+        :param key: object
+        :return: SamplesCube
+        """
+        rows = self.groups[key]
+        return SamplesCube(self.values[rows], self.mask[rows], self.dates[rows], self.samples_index[rows])
+
+    def resample(self, grid_dates, method='linear', date_from=None, date_to=None):
+        """
+        Returns a new cube whose time series are resampled onto @grid_dates, e.g. a regular grid built with
+        numpy.arange(start, stop, numpy.timedelta64(16, 'D')) (see Timeline.resample_values()).
+        Its dates member is a read-only view repeating @grid_dates for every sample.
+        :param grid_dates: numpy.array
+        :param method: string
+        :param date_from: numpy.datetime64 or numpy.array
+        :param date_to: numpy.datetime64 or numpy.array
+        :return: SamplesCube
+        """
+        grid_dates = numpy.asarray(grid_dates, dtype=self.dates.dtype)
+        values, mask = Timeline.resample_values(self.values, self.mask, self.dates, grid_dates, method, date_from,
+                                                date_to)
+        return SamplesCube(values, mask, numpy.broadcast_to(grid_dates, (len(self), len(grid_dates))),
+                           self.samples_index, self.groups)
+
+
 class Mygdal:
     # GeoTransform Constants Indexes
     GT_X = 0
@@ -47,109 +425,497 @@ class Mygdal:
     GT_Y_SKEW = 4
     GT_Y_RES = 5
 
-    def __init__(self, filename):
-        self.dataset = gdal.Open(filename)
-        if not self.dataset:
+    METADATA = ('srs_wkt', 'srs', 'width', 'height', 'size', 'bands_count', 'geo_transform', 'geo_resolution',
+                'geo_skew', 'geo_ul', 'geo_matrix', 'geo_rotated', 'geo_matrix_inv', 'geo_lr', 'geo_size',
+                'geo_size_abs', 'values_nodata', 'block_size', 'dtype')
+    METADATA_SIDECAR = '%s.mygdal.json'
+
+    def __init__(self, filename, block_cache=None, pool=None, lazy=False, metadata_cache=False):
+        """
+        Opens the image @filename. Reads may go through a @block_cache (see BlockCache) and the dataset may be
+        opened on demand by a @pool (see DatasetPool). If @lazy is True, neither the dataset is opened nor its
+        metadata read until they are first used. If @metadata_cache is True, metadata are read from a small
+        json sidecar file next to the image, written on first use, so the dataset is only opened to be read.
+        Read counters (see Instruments) report the image by its name member, @filename by default.
+        :param filename: string
+        :param block_cache: BlockCache
+        :param pool: DatasetPool
+        :param lazy: bool
+        :param metadata_cache: bool
+        """
+        self.filename = filename
+        self.name = filename
+        self.block_cache = block_cache
+        self.pool = pool
+        self.metadata_cache = metadata_cache
+        self.grid_reference = None
+        self.lock = threading.Lock()
+        self.__dataset__ = None
+        self.__metadata_loaded__ = False
+        if not lazy:
+            self.__load_metadata__()
+
+    def __getattr__(self, name):
+        if name in Mygdal.METADATA and not self.__dict__.get('__metadata_loaded__', True):
+            self.__load_metadata__()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    @staticmethod
+    def open_dataset(filename):
+        result = gdal.Open(filename)
+        if not result:
             raise Exception(__error_missing_file__, __error_missing_file_msg__ % filename)
-        self.srs_wkt = self.dataset.GetProjectionRef()
+        return result
+
+    @property
+    def dataset(self):
+        """
+        The GDAL dataset, opened on first use or taken from the pool.
+        """
+        if self.pool is not None:
+            return self.pool.get(self.filename)
+        if self.__dataset__ is None:
+            self.__dataset__ = Mygdal.open_dataset(self.filename)
+        return self.__dataset__
+
+    def __get_dataset_entry__(self):
+        """
+        Returns the dataset and the lock to hold while using it, the pool's one if the dataset is pooled.
+        :return: tuple
+        """
+        if self.pool is not None:
+            return self.pool.get_entry(self.filename)
+        return self.dataset, self.lock
+
+    def __load_metadata__(self):
+        """
+        Loads image metadata from its sidecar file if enabled and up to date, from the dataset otherwise.
+        """
+        metadata = None
+        file_key = get_file_key(self.filename) if self.metadata_cache else None
+        if self.metadata_cache:
+            try:
+                with open(Mygdal.METADATA_SIDECAR % self.filename) as file:
+                    metadata = json.load(file)
+                if metadata.get('file_key') != file_key:
+                    metadata = None
+            except (OSError, ValueError):
+                metadata = None
+        if metadata is None:
+            dataset, lock = self.__get_dataset_entry__()
+            with lock:
+                metadata = {'file_key': file_key, 'srs_wkt': dataset.GetProjectionRef(),
+                            'width': dataset.RasterXSize, 'height': dataset.RasterYSize,
+                            'geo_transform': list(dataset.GetGeoTransform()),
+                            'values_nodata': [dataset.GetRasterBand(i).GetNoDataValue()
+                                              for i in range(1, dataset.RasterCount + 1)],
+                            'block_size': list(dataset.GetRasterBand(1).GetBlockSize()),
+                            'data_type': dataset.GetRasterBand(1).DataType}
+            if self.metadata_cache:
+                try:
+                    with open(Mygdal.METADATA_SIDECAR % self.filename, 'w') as file:
+                        json.dump(metadata, file)
+                except OSError:
+                    pass
+        self.__set_metadata__(metadata)
+
+    def __set_metadata__(self, metadata):
+        self.__metadata_loaded__ = True
+        self.srs_wkt = metadata['srs_wkt']
         self.srs = osr.SpatialReference()
         self.srs.ImportFromWkt(self.srs_wkt)
-        self.width = self.dataset.RasterXSize
-        self.height = self.dataset.RasterYSize
+        self.width = metadata['width']
+        self.height = metadata['height']
         self.size = numpy.array([self.width, self.height], dtype=numpy.dtype(int))
-        geo_transform = self.dataset.GetGeoTransform()
+        geo_transform = metadata['geo_transform']
+        self.geo_transform = tuple(geo_transform)
         self.geo_resolution = ord_pair(geo_transform[Mygdal.GT_X_RES], geo_transform[Mygdal.GT_Y_RES])
         self.geo_skew = ord_pair(geo_transform[Mygdal.GT_Y_SKEW], geo_transform[Mygdal.GT_X_SKEW])
         self.geo_ul = ord_pair(geo_transform[Mygdal.GT_X_UL], geo_transform[Mygdal.GT_Y_UL])
+        self.geo_matrix = numpy.array([[geo_transform[Mygdal.GT_X_RES], geo_transform[Mygdal.GT_X_SKEW]],
+                                       [geo_transform[Mygdal.GT_Y_SKEW], geo_transform[Mygdal.GT_Y_RES]]])
+        self.geo_rotated = bool(numpy.any(self.geo_skew))
+        self.geo_matrix_inv = numpy.linalg.inv(self.geo_matrix) if self.geo_rotated else None
         self.geo_lr = self.pixels_to_geolocs(ord_pair(self.width - 1, self.height - 1))
         self.geo_size = self.geo_lr - self.geo_ul
         self.geo_size_abs = numpy.abs(self.geo_size)
-        self.values_nodata = numpy.array([self.dataset.GetRasterBand(i).GetNoDataValue()
-                                          for i in range(1, self.dataset.RasterCount + 1)])
+        self.values_nodata = numpy.array(metadata['values_nodata'])
+        self.bands_count = len(self.values_nodata)
+        self.block_size = numpy.array(metadata['block_size'], dtype=numpy.dtype(int))
+        self.dtype = numpy.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(metadata['data_type']))
+        if self.grid_reference is not None:
+            self.set_grid_reference(self.grid_reference)
 
     def close_dataset(self):
-        self.dataset = None
+        self.__dataset__ = None
+        if self.pool is not None:
+            self.pool.close(self.filename)
+
+    def set_grid_reference(self, mygdal_obj):
+        """
+        Requires this image to have the same grid than @mygdal_obj (see is_same_grid()). The verification
+        is made at once if metadata are loaded, otherwise when they are loaded.
+        :param mygdal_obj: Mygdal
+        """
+        self.grid_reference = mygdal_obj
+        if self.__metadata_loaded__ and not mygdal_obj.is_same_grid(self):
+            raise Exception(__error_stacks_grid__, __error_stacks_grid_msg__ % (self.filename, mygdal_obj.filename))
+
+    def is_same_grid(self, mygdal_obj):
+        """
+        Verifies if @mygdal_obj has the same size, geotransform and system of reference than this image,
+        so the same pixel indexes can be used to read both.
+        :param mygdal_obj: Mygdal
+        :return: bool
+        """
+        return (numpy.array_equal(self.size, mygdal_obj.size) and self.geo_transform == mygdal_obj.geo_transform and
+                (self.srs_wkt == mygdal_obj.srs_wkt or bool(self.srs.IsSame(mygdal_obj.srs))))
 
     def get_random_geolocs(self, n=1, bbox_ul=None, bbox_lr=None, seed=None):
-        if seed:
-            numpy.random.seed(seed)
-        ul = self.geo_ul
-        lr = self.geo_lr
-        if numpy.any((ul * numpy.sign(self.geo_resolution)) > (lr * numpy.sign(self.geo_resolution))):
-            raise Exception(__error_invalid_bbox__, __error_invalid_bbox_msg__)
-        if bbox_ul:
-            if numpy.any(bbox_ul < (ul * numpy.sign(self.geo_resolution))):
-                raise Exception(__error_outbounds__, __error_outbounds_msg__)
-            ul = bbox_ul
-        if bbox_lr:
-            if numpy.any(bbox_lr > (lr * numpy.sign(self.geo_resolution))):
-                raise Exception(__error_outbounds__, __error_outbounds_msg__)
-            lr = bbox_lr
-        return ul + numpy.random.rand(n, 2) * (lr - ul)
+        """
+        Draws @n random points uniformly in the image, or in the bounding box given by @bbox_ul and @bbox_lr,
+        which must be inside the image, a missing corner being the image's one. Points are drawn by a local
+        generator (see numpy.random.default_rng()), so @seed may be an integer or a numpy.random.Generator
+        shared by several calls.
+        :param n: integer
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :param seed: integer or numpy.random.Generator
+        :return: numpy.array
+        """
+        rng = numpy.random.default_rng(seed)
+        if bbox_ul is None and bbox_lr is None:
+            return self.pixels_to_geolocs(rng.random((n, 2)) * self.size)
+        ul, lr = self.__check_geolocs_bbox__(bbox_ul, bbox_lr)[0]
+        return ul + rng.random((n, 2)) * (lr - ul)
 
     def get_random_pixels(self, n=1, bbox_ul=None, bbox_lr=None, seed=None):
-        if seed:
-            numpy.random.seed(seed)
-        ul = numpy.array([0, 0], dtype=numpy.dtype(int))
-        lr = self.size - 1
+        """
+        Draws @n random pixels uniformly in the image, or in the pixels box given by @bbox_ul and @bbox_lr,
+        both inclusive. @seed is used as in get_random_geolocs().
+        :param n: integer
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :param seed: integer or numpy.random.Generator
+        :return: numpy.array
+        """
+        ul, lr = self.__check_pixels_bbox__(bbox_ul, bbox_lr)
+        return numpy.random.default_rng(seed).integers(ul, lr, (n, 2), endpoint=True)
+
+    def __check_geolocs_bbox__(self, bbox_ul, bbox_lr):
+        """
+        Returns the corners of the bounding box given by @bbox_ul and @bbox_lr, the image outer corners by
+        default, and the inclusive box of the pixels it covers. Raises an exception if it is out of the image,
+        @bbox_lr being allowed on the image outer edge.
+        """
+        corners = numpy.array([self.geo_ul if bbox_ul is None else bbox_ul,
+                               self.pixels_to_geolocs(self.size) if bbox_lr is None else bbox_lr],
+                              dtype=numpy.float64)
+        offsets = corners - self.geo_ul
+        pixels = numpy.dot(offsets, self.geo_matrix_inv.T) if self.geo_rotated else offsets / self.geo_resolution
+        if numpy.any(pixels[0] < 0) or numpy.any(pixels[0] >= self.size) or numpy.any(pixels[1] > self.size):
+            raise Exception(__error_outbounds__, __error_outbounds_msg__)
+        if numpy.any(pixels[0] > pixels[1]):
+            raise Exception(__error_invalid_bbox__, __error_invalid_bbox_msg__)
+        ul = numpy.array(numpy.floor(pixels[0]), dtype=numpy.dtype(int))
+        return corners, (ul, numpy.maximum(numpy.array(numpy.ceil(pixels[1]), dtype=numpy.dtype(int)) - 1, ul))
+
+    def __check_pixels_bbox__(self, bbox_ul, bbox_lr):
+        """
+        Returns the inclusive pixels box given by @bbox_ul and @bbox_lr, the whole image by default.
+        Raises an exception if it is out of the image or empty.
+        """
+        ul = numpy.array([0, 0] if bbox_ul is None else bbox_ul, dtype=numpy.dtype(int))
+        lr = numpy.array(self.size - 1 if bbox_lr is None else bbox_lr, dtype=numpy.dtype(int))
+        if numpy.any(ul < 0) or numpy.any(lr >= self.size):
+            raise Exception(__error_outbounds__, __error_outbounds_msg__)
         if numpy.any(ul > lr):
             raise Exception(__error_invalid_bbox__, __error_invalid_bbox_msg__)
-        if bbox_ul:
-            if numpy.any(bbox_ul < ul):
-                raise Exception(__error_outbounds__, __error_outbounds_msg__)
-            ul = bbox_ul
-        if bbox_lr:
-            if numpy.any(bbox_lr > lr):
-                raise Exception(__error_outbounds__, __error_outbounds_msg__)
-            lr = bbox_lr
-        return ul + numpy.array(numpy.random.rand(n, 2) * (lr - ul), dtype=numpy.dtype(int))
+        return ul, lr
+
+    def get_random_valid_geolocs(self, n=1, bbox_ul=None, bbox_lr=None, seed=None, stacks=(), all_bands=True,
+                                 pixels_per_block=1, batch_size=65536, max_draws=None):
+        """
+        Draws @n random points uniformly in the pixels which hold data in this image and in every image of
+        @stacks (see get_random_valid_pixels()). If @bbox_ul and @bbox_lr are given (see get_random_geolocs()),
+        points are drawn in the pixels they fall in, so the box is extended to whole pixels.
+        :param n: integer
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :param seed: integer or numpy.random.Generator
+        :param stacks: list
+        :param all_bands: bool
+        :param pixels_per_block: integer
+        :param batch_size: integer
+        :param max_draws: integer
+        :return: numpy.array
+        """
+        rng = numpy.random.default_rng(seed)
+        if bbox_ul is None and bbox_lr is None:
+            ul, lr = self.__check_pixels_bbox__(None, None)
+        else:
+            ul, lr = self.__check_geolocs_bbox__(bbox_ul, bbox_lr)[1]
+        pixels = self.__get_random_valid__(n, ul, lr, rng, stacks, all_bands, pixels_per_block, batch_size,
+                                           max_draws)
+        return self.pixels_to_geolocs(pixels + rng.random(pixels.shape))
+
+    def get_random_valid_pixels(self, n=1, bbox_ul=None, bbox_lr=None, seed=None, stacks=(), all_bands=True,
+                                pixels_per_block=1, batch_size=65536, max_draws=None):
+        """
+        Draws @n random pixels uniformly among the pixels of the box given by @bbox_ul and @bbox_lr (see
+        get_random_pixels()) which hold data in this image and in every image of @stacks, which must have
+        the same grid. If @all_bands is True, a pixel must hold data in every band of each image, otherwise
+        in at least one band of each image.
+        Candidates are drawn independently in vectorized batches of up to @batch_size pixels, sized from the
+        valid ratio seen so far, and each batch is read block by block (see read_pixels_values()).
+        A @pixels_per_block greater than 1 trades independence for fewer reads: blocks are then picked at
+        random, weighted by their pixels in the box, and that many candidates are drawn in each one, so the
+        pixels are still uniform one by one but come in clusters. Returns exactly @n pixels, which may
+        repeat. Raises an exception if they are not found in @max_draws candidates (default 1000 * @n +
+        @batch_size).
+        :param n: integer
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :param seed: integer or numpy.random.Generator
+        :param stacks: list
+        :param all_bands: bool
+        :param pixels_per_block: integer
+        :param batch_size: integer
+        :param max_draws: integer
+        :return: numpy.array
+        """
+        ul, lr = self.__check_pixels_bbox__(bbox_ul, bbox_lr)
+        return self.__get_random_valid__(n, ul, lr, numpy.random.default_rng(seed), stacks, all_bands,
+                                         pixels_per_block, batch_size, max_draws)
+
+    def __get_random_valid__(self, n, ul, lr, rng, stacks, all_bands, pixels_per_block, batch_size, max_draws):
+        """
+        Draws batches of candidates block by block in the inclusive pixels box [@ul, @lr] until @n of them
+        are valid (see get_random_valid_pixels()).
+        """
+        max_draws = 1000 * n + batch_size if max_draws is None else max_draws
+        blocks = numpy.stack(numpy.meshgrid(numpy.arange(ul[Mygdal.GT_X] // self.block_size[Mygdal.GT_X],
+                                                         lr[Mygdal.GT_X] // self.block_size[Mygdal.GT_X] + 1),
+                                            numpy.arange(ul[Mygdal.GT_Y] // self.block_size[Mygdal.GT_Y],
+                                                         lr[Mygdal.GT_Y] // self.block_size[Mygdal.GT_Y] + 1),
+                                            indexing='ij'), axis=-1).reshape(-1, 2)
+        blocks_ul = numpy.maximum(blocks * self.block_size, ul)
+        blocks_size = numpy.minimum((blocks + 1) * self.block_size - 1, lr) - blocks_ul + 1
+        blocks_weight = numpy.prod(blocks_size, axis=1) / numpy.prod(blocks_size, axis=1).sum()
+        result = []
+        found = draws = valid_count = 0
+        while found < n:
+            if draws >= max_draws:
+                raise Exception(__error_no_valid_pixels__, __error_no_valid_pixels_msg__ % (found, n, draws))
+            if valid_count:
+                size = min(batch_size, int((n - found) * draws / valid_count * 1.25) + 1)
+            else:
+                size = min(batch_size, 2 * (n - found))
+            picked = rng.choice(len(blocks), -(-size // pixels_per_block), p=blocks_weight)
+            picked = numpy.repeat(picked, pixels_per_block)
+            pixels = blocks_ul[picked] + rng.integers(0, blocks_size[picked])
+            draws += len(pixels)
+            valid = numpy.ones(len(pixels), dtype=bool)
+            for stack in [self] + list(stacks):
+                if not valid.any():
+                    break
+                mask = stack.mask_nodata_pixel_bands(stack.read_pixels_values(pixels[valid]))
+                valid[valid] = numpy.all(mask, axis=1) if all_bands else numpy.any(mask, axis=1)
+            valid_count += numpy.count_nonzero(valid)
+            result.append(rng.permutation(pixels[valid])[:n - found])
+            found += len(result[-1])
+        return numpy.concatenate(result) if result else numpy.empty((0, 2), dtype=numpy.dtype(int))
 
     def are_valid_geolocs(self, geolocs):
         """
         Verifies if each point in geolocs belongs to image bounding box.
         Points in @geolocs must be in same system of reference than image's.
-        Returns True if all points are valid, False otherwise.
+        Returns a mask which is True for each valid point.
         :param geolocs: numpy.array
-        :return: bool
+        :return: numpy.array
         """
-        return numpy.any((geolocs < (self.geo_ul * numpy.sign(self.geo_resolution))) *
-                         (geolocs > (self.geo_lr * numpy.sign(self.geo_resolution))))
+        return self.geolocs_to_pixels(numpy.reshape(geolocs, (-1, 2)), with_mask=True)[1]
 
     def are_valid_pixels(self, pixels):
         """
         Verifies if each pixel in pixels belongs to image size.
         Pixels in @pixels parameter must be in same system of reference than image's.
-        Returns True if all pixels are valid, False otherwise.
+        Returns a mask which is True for each valid pixel.
         :param pixels: numpy.array
-        :return: bool
+        :return: numpy.array
         """
-        return numpy.any((pixels < numpy.array([0, 0])) * (pixels > self.size))
+        pixels = numpy.reshape(pixels, (-1, 2))
+        return numpy.all((pixels >= 0) & (pixels < self.size), axis=1)
 
     def pixels_to_geolocs(self, pixels):
+        """
+        Converts pixel indexes to the coordinates of their upper left corner applying the full geotransform,
+        so rotated images are supported.
+        :param pixels: numpy.array
+        :return: numpy.array
+        """
         result = numpy.array([])
         if pixels is not None and len(pixels):
-            result = self.geo_ul + self.geo_resolution * pixels + self.geo_skew * pixels
+            result = self.geo_ul + numpy.dot(pixels, self.geo_matrix.T)
         return result
 
-    def geolocs_to_pixels(self, geolocs):
-        result = numpy.array([])
+    @timed_stage('pixel_conversion')
+    def geolocs_to_pixels(self, geolocs, with_mask=False):
+        """
+        Converts all points in @geolocs to the indexes of the pixels they fall in, in one vectorized pass.
+        Rotated images are converted with the inverse geotransform, computed once per image.
+        If @with_mask is True, also returns a mask which is True for each point inside the image, computed
+        in the same pass (see are_valid_pixels()).
+        :param geolocs: numpy.array
+        :param with_mask: bool
+        :return: numpy.array or tuple
+        """
+        result = numpy.array([], dtype=numpy.dtype(int))
+        mask = numpy.array([], dtype=bool)
         if geolocs is not None and len(geolocs):
-            result = (geolocs - self.geo_ul)
-            with numpy.errstate(divide='ignore', invalid='ignore'):
-                result_geo_resolution = numpy.floor_divide(result, self.geo_resolution)
-                result_geo_skew = numpy.floor_divide(result, self.geo_skew)
-                result_geo_resolution[~numpy.isfinite(result_geo_resolution)] = 0
-                result_geo_skew[~numpy.isfinite(result_geo_skew)] = 0
-            result = numpy.array(result_geo_resolution + result_geo_skew, dtype=numpy.dtype(int))
+            result = numpy.asarray(geolocs, dtype=numpy.float64) - self.geo_ul
+            if self.geo_rotated:
+                result = numpy.floor(numpy.dot(result, self.geo_matrix_inv.T))
+            else:
+                result = numpy.floor_divide(result, self.geo_resolution)
+            result = numpy.array(result, dtype=numpy.dtype(int))
+            if with_mask:
+                mask = numpy.all((result >= 0) & (result < self.size), axis=-1)
+        if with_mask:
+            return result, mask
         return result
 
     def read_pixel_values(self, pixel):
-        result = self.dataset.ReadAsArray(int(pixel[Mygdal.GT_X]), int(pixel[Mygdal.GT_Y]), xsize=1, ysize=1)
+        if self.block_cache is not None:
+            pixel = numpy.array(pixel, dtype=numpy.dtype(int))
+            block = pixel // self.block_size
+            offset = pixel - block * self.block_size
+            values = self.read_block_values(block[Mygdal.GT_X], block[Mygdal.GT_Y])
+            return values[:, offset[Mygdal.GT_Y], offset[Mygdal.GT_X]].copy()
+        result = self.__read_raster__(pixel[Mygdal.GT_X], pixel[Mygdal.GT_Y], 1, 1)
         return numpy.reshape(result, len(result))
 
+    def read_window_values(self, x, y, xsize, ysize):
+        """
+        Reads all bands values of the window starting at pixel (@x, @y) with the given size.
+        Returns an array with shape (bands, @ysize, @xsize), even for single band images.
+        If the image has a block cache, the window is assembled from the cached blocks it overlaps.
+        :param x: integer
+        :param y: integer
+        :param xsize: integer
+        :param ysize: integer
+        :return: numpy.array
+        """
+        x, y, xsize, ysize = int(x), int(y), int(xsize), int(ysize)
+        if self.block_cache is None:
+            return self.__read_raster__(x, y, xsize, ysize)
+        window_ul = ord_pair(x, y)
+        window_lr = ord_pair(x + xsize, y + ysize)
+        if numpy.any(window_ul < 0) or numpy.any(window_lr > self.size):
+            raise Exception(__error_outbounds__, __error_outbounds_msg__)
+        result = None
+        blocks_ul = window_ul // self.block_size
+        blocks_lr = (window_lr - 1) // self.block_size
+        for block_y in range(blocks_ul[Mygdal.GT_Y], blocks_lr[Mygdal.GT_Y] + 1):
+            for block_x in range(blocks_ul[Mygdal.GT_X], blocks_lr[Mygdal.GT_X] + 1):
+                values = self.read_block_values(block_x, block_y)
+                if result is None:
+                    result = numpy.empty((len(values), ysize, xsize), dtype=values.dtype)
+                block_ul = ord_pair(block_x, block_y) * self.block_size
+                ul = numpy.maximum(window_ul, block_ul)
+                lr = numpy.minimum(window_lr, block_ul + self.block_size)
+                result[:, ul[Mygdal.GT_Y] - y:lr[Mygdal.GT_Y] - y, ul[Mygdal.GT_X] - x:lr[Mygdal.GT_X] - x] = \
+                    values[:, ul[Mygdal.GT_Y] - block_ul[Mygdal.GT_Y]:lr[Mygdal.GT_Y] - block_ul[Mygdal.GT_Y],
+                           ul[Mygdal.GT_X] - block_ul[Mygdal.GT_X]:lr[Mygdal.GT_X] - block_ul[Mygdal.GT_X]]
+        return result
+
+    def read_block_values(self, block_x, block_y):
+        """
+        Reads all bands values of the image block at (@block_x, @block_y), going through the
+        block cache if the image has one. Cached blocks are returned as read-only arrays.
+        :param block_x: integer
+        :param block_y: integer
+        :return: numpy.array
+        """
+        block_ul = ord_pair(block_x, block_y) * self.block_size
+        if numpy.any(block_ul < 0) or numpy.any(block_ul >= self.size):
+            raise Exception(__error_outbounds__, __error_outbounds_msg__)
+        key = None
+        if self.block_cache is not None:
+            key = (self.filename, (1, self.bands_count), int(block_x), int(block_y))
+            result = self.block_cache.get(key)
+            if result is not None:
+                return result
+        block_size = numpy.minimum(self.block_size, self.size - block_ul)
+        result = self.__read_raster__(block_ul[Mygdal.GT_X], block_ul[Mygdal.GT_Y],
+                                      block_size[Mygdal.GT_X], block_size[Mygdal.GT_Y])
+        if key is not None:
+            result.flags.writeable = False
+            self.block_cache.put(key, result)
+        return result
+
+    @timed_stage('read')
+    def __read_raster__(self, x, y, xsize, ysize):
+        dataset, lock = self.__get_dataset_entry__()
+        with lock:
+            result = dataset.ReadAsArray(int(x), int(y), xsize=int(xsize), ysize=int(ysize))
+        result = numpy.reshape(result, (self.bands_count, int(ysize), int(xsize)))
+        if __instruments__ is not None:
+            __instruments__.add_read(self.name, result)
+        return result
+
+    def get_spatial_index(self, pixels):
+        return SpatialIndex(pixels, self.block_size)
+
+    def read_pixels_values(self, pixels, spatial_index=None):
+        """
+        Reads all bands values of each pixel in @pixels. Pixels are grouped by the image block
+        (tile or strip) they fall in, so each block is read only once and its values are gathered
+        by fancy indexing. Blocks are read in storage order, as given by @spatial_index, which is
+        built if missing or if it was built for another block size.
+        Returns an array with shape (pixels, bands), where each row is equal to what
+        read_pixel_values() returns for the same pixel.
+        :param pixels: numpy.array
+        :param spatial_index: SpatialIndex
+        :return: numpy.array
+        """
+        pixels = numpy.reshape(numpy.array(pixels, dtype=numpy.dtype(int)), (-1, 2))
+        if numpy.any((pixels < 0) | (pixels >= self.size)):
+            raise Exception(__error_outbounds__, __error_outbounds_msg__)
+        if spatial_index is None or not numpy.array_equal(spatial_index.block_size, self.block_size):
+            spatial_index = self.get_spatial_index(pixels)
+        result = numpy.empty((0, self.bands_count))
+        for block, block_indexes in spatial_index.iter_buckets():
+            block_ul = numpy.array(block) * self.block_size
+            values = self.read_block_values(*block)
+            if not len(result):
+                result = numpy.empty((len(pixels), len(values)), dtype=values.dtype)
+            offsets = pixels[block_indexes] - block_ul
+            result[block_indexes] = values[:, offsets[:, Mygdal.GT_Y], offsets[:, Mygdal.GT_X]].T
+        return result
+
     def mask_nodata_pixel_bands(self, pixel_bands):
         return pixel_bands != self.values_nodata
 
+    def mask_nodata_window_bands(self, window_bands):
+        return window_bands != numpy.reshape(self.values_nodata, (-1, 1, 1))
+
+    def iter_windows(self, tile_size=None):
+        """
+        Iterates over the tiles covering the whole image, row by row, yielding (x, y, xsize, ysize) windows.
+        @tile_size may be an integer or a (xsize, ysize) pair and defaults to the image block size. Tiles
+        multiple of the block size avoid reading the same block twice.
+        :param tile_size: integer or numpy.array
+        :return: generator
+        """
+        tile_size = self.block_size if tile_size is None else numpy.array(tile_size, dtype=numpy.dtype(int)) * [1, 1]
+        tile_xsize, tile_ysize = int(tile_size[Mygdal.GT_X]), int(tile_size[Mygdal.GT_Y])
+        for y in range(0, self.height, tile_ysize):
+            for x in range(0, self.width, tile_xsize):
+                yield x, y, min(tile_xsize, self.width - x), min(tile_ysize, self.height - y)
+
+    @timed_stage('reprojection')
     def reproject_geolocs_from(self, geolocs, geo_srs_wkt_from):
         """
         Reprojects all points in @geolocs from a given system of reference to the image's one.
@@ -158,15 +924,79 @@ class Mygdal:
         :param geo_srs_wkt_from: string
         :return: numpy.array
         """
-        if self.srs_wkt == geo_srs_wkt_from:
+        transform = get_coordinate_transformation(geo_srs_wkt_from, self.srs_wkt)
+        if transform is None:
             return geolocs
-        srs_from = osr.SpatialReference()
-        srs_from.ImportFromWkt(geo_srs_wkt_from)
-        transform = osr.CoordinateTransformation(srs_from, self.srs)
-        result = numpy.array(transform.TransformPoints(geolocs))[:, 0:2]
+        if not len(geolocs):
+            return numpy.empty((0, 2))
+        result = numpy.array(transform.TransformPoints(numpy.asarray(geolocs, dtype=numpy.float64)))[:, 0:2]
         return result
 
 
+class MygdalStacks(Mygdal):
+    """
+    Single virtual image made of all bands of several stacks with the same grid, built as an in-memory VRT
+    (no file is written), so a window of every stack is fetched with one RasterIO call.
+    All bands are exposed with the smallest data type able to hold every stack's values.
+    """
+
+    def __init__(self, stacks, block_cache=None):
+        for stack in stacks[1:]:
+            if not stacks[0].is_same_grid(stack):
+                raise Exception(__error_stacks_grid__, __error_stacks_grid_msg__ % (stack.filename, stacks[0].filename))
+        self.stacks = stacks
+        self.stacks_bands = numpy.cumsum([stack.bands_count for stack in stacks])[:-1]
+        super(MygdalStacks, self).__init__(MygdalStacks.build_vrt(stacks), block_cache)
+        self.name = 'vrt:' + ','.join(stack.filename for stack in stacks)
+
+    @staticmethod
+    def build_vrt(stacks):
+        """
+        Returns the XML of a VRT dataset whose bands are all bands of @stacks, in order.
+        The VRT takes its grid and block size from the first stack.
+        :param stacks: list
+        :return: string
+        """
+        data_type = gdal.GetDataTypeName(gdal_array.NumericTypeCodeToGDALTypeCode(
+            numpy.result_type(*[stack.dtype for stack in stacks])))
+        geo_transform = ', '.join(repr(float(value)) for value in stacks[0].geo_transform)
+        result = ['<VRTDataset rasterXSize="%d" rasterYSize="%d">' % (stacks[0].width, stacks[0].height),
+                  '<SRS>%s</SRS>' % escape(stacks[0].srs_wkt), '<GeoTransform>%s</GeoTransform>' % geo_transform]
+        band = 0
+        for stack in stacks:
+            for i in range(1, stack.bands_count + 1):
+                band += 1
+                result.append('<VRTRasterBand dataType="%s" band="%d" blockXSize="%d" blockYSize="%d">' %
+                              (data_type, band, stacks[0].block_size[Mygdal.GT_X],
+                               stacks[0].block_size[Mygdal.GT_Y]))
+                if stack.values_nodata[i - 1] is not None:
+                    result.append('<NoDataValue>%r</NoDataValue>' % float(stack.values_nodata[i - 1]))
+                result.append('<SimpleSource><SourceFilename relativeToVRT="0">%s</SourceFilename>'
+                              '<SourceBand>%d</SourceBand>'
+                              '<SrcRect xOff="0" yOff="0" xSize="%d" ySize="%d"/>'
+                              '<DstRect xOff="0" yOff="0" xSize="%d" ySize="%d"/></SimpleSource></VRTRasterBand>' %
+                              (escape(stack.filename), i, stack.width, stack.height, stack.width, stack.height))
+        result.append('</VRTDataset>')
+        return ''.join(result)
+
+    def split_stacks(self, values, axis):
+        """
+        Splits @values read from this image along the bands @axis into one array per stack,
+        each one converted back to its stack data type.
+        :param values: numpy.array
+        :param axis: integer
+        :return: list
+        """
+        return [stack_values.astype(stack.dtype, copy=False)
+                for stack, stack_values in zip(self.stacks, numpy.split(values, self.stacks_bands, axis=axis))]
+
+    def read_pixels_stacks(self, pixels, spatial_index=None):
+        return self.split_stacks(self.read_pixels_values(pixels, spatial_index), 1)
+
+    def read_window_stacks(self, x, y, xsize, ysize):
+        return self.split_stacks(self.read_window_values(x, y, xsize, ysize), 0)
+
+
 class MyTCSV:
     TAG_DELIMITER = 'delimiter'
     TAG_HAS_HEADER = 'has_header'
@@ -176,6 +1006,8 @@ class MyTCSV:
     def __init__(self, filename, encoding='utf-8', delimiter=',', has_header='False', decimal='.', quote='"'):
         self.file = open(filename, encoding=encoding)
         self.__row__ = None
+        self.__columns__ = []
+        self.__data_groups__ = {}
         self.data = []
         self.field_names = []
         self.__fetch_tags__()
@@ -223,25 +1055,68 @@ class MyTCSV:
     def __process_row_data__(self):
         """
         Process data row loaded in __row__ by calling __transform_row_data__() method
-        and stores it into object's data member.
+        and appends its values to the columns being loaded.
         """
         row = self.__transform_row_data__(self.__row__.split(self.tags[MyTCSV.TAG_DELIMITER]))
-        if len(self.data):
-            for i in range(len(row)):
-                self.data[i] = numpy.append(self.data[i], row[i])
-        else:
-            for i in range(len(row)):
-                self.data.append(numpy.array([row[i]], dtype=type(row[i])))
+        if not self.__columns__:
+            self.__columns__ = [[] for _ in range(len(row))]
+        for column, value in zip(self.__columns__, row):
+            column.append(value)
 
+    def __build_columns__(self):
+        """
+        Converts the columns loaded by __process_row_data__() to typed arrays and resets them.
+        Each column takes the type of its first value, except dates which are stored as datetime64.
+        :return: list
+        """
+        result = []
+        for column in self.__columns__:
+            if isinstance(column[0], datetime.datetime):
+                result.append(numpy.array(column, dtype=numpy.dtype('datetime64[us]')))
+            else:
+                result.append(numpy.array(column, dtype=type(column[0])))
+        self.__columns__ = []
+        return result
+
+    def __fetch_rows__(self):
+        """
+        Iterates over the remaining non empty data rows, loading each one in __row__ member.
+        """
+        self.__row__ = self.__row__.strip()
+        if self.__row__:
+            yield self.__row__
+        for self.__row__ in self.file:
+            self.__row__ = self.__row__.strip()
+            if self.__row__:
+                yield self.__row__
+
+    @timed_stage('fetch_data')
     def fetch_data(self):
         """
         Loads all file's data to internal data member. Each fetched row is processed by
         __process_row_data__() method.
         """
-        self.__process_row_data__()
-        for self.__row__ in self.file:
-            self.__row__ = self.__row__.strip()
+        for _ in self.__fetch_rows__():
             self.__process_row_data__()
+        self.data = self.__build_columns__()
+
+    def iter_chunks(self, n):
+        """
+        Loads file's data in chunks of at most @n rows, so huge files can be processed without
+        loading them fully. Each chunk is yielded as a list of columns and is also set as data member
+        while it is being processed, so any method working on data member can be used on it.
+        Like fetch_data(), file's data can be iterated only once.
+        :param n: integer
+        :return: generator
+        """
+        for _ in self.__fetch_rows__():
+            self.__process_row_data__()
+            if len(self.__columns__[0]) >= n:
+                self.data = self.__build_columns__()
+                yield self.data
+        if self.__columns__:
+            self.data = self.__build_columns__()
+            yield self.data
 
     def __transform_tag_value__(self, tag_name, tag_value):
         """
@@ -298,15 +1173,87 @@ class MyTCSV:
             return int(field_ref)
 
     def get_data_key_indexes(self, field_ref):
-        result = {}
+        """
+        Groups the data rows by the values of the column @field_ref. Returns a dict of the rows indexes
+        (ascending) of each value, with values in order of first appearance.
+        :param field_ref: string or integer
+        :return: dict
+        """
+        keys, groups = self.__get_data_groups__(field_ref)
+        if len(groups) == 0:
+            return {}
+        bounds = numpy.cumsum(numpy.bincount(groups, minlength=len(keys)))[:-1]
+        indexes = numpy.split(numpy.argsort(groups, kind='stable'), bounds)
+        first = numpy.array([value[0] for value in indexes])
+        return {keys[i]: indexes[i] for i in numpy.argsort(first)}
+
+    def get_stratified_indexes(self, field_ref, n, seed=None):
+        """
+        Draws at random @n data rows of each value of the column @field_ref, or all its rows if it has less.
+        @n may also be a dict of rows count by value, values not in it being left out.
+        Draws only depend on @seed (see numpy.random.default_rng()). Returns the rows indexes (ascending),
+        to be given as samples_index.
+        :param field_ref: string or integer
+        :param n: integer or dict
+        :param seed: integer
+        :return: numpy.array
+        """
+        keys, groups = self.__get_data_groups__(field_ref)
+        if isinstance(n, dict):
+            n = numpy.array([n.get(key, 0) for key in keys], dtype=numpy.dtype(int))
+        ranks, _ = MyTCSV.__get_random_ranks__(groups, numpy.random.default_rng(seed))
+        return numpy.flatnonzero(ranks < numpy.broadcast_to(n, len(keys))[groups])
+
+    def get_split_indexes(self, test_fraction=0.25, field_ref=None, seed=None):
+        """
+        Splits at random the data rows into a training and a test set, the test set having @test_fraction of
+        the rows (rounded). If @field_ref is given, the split is stratified: each value of the column keeps
+        the same proportion in both sets. Draws only depend on @seed (see numpy.random.default_rng()).
+        Returns the training and the test rows indexes (ascending), to be given as samples_index.
+        :param test_fraction: float
+        :param field_ref: string or integer
+        :param seed: integer
+        :return: tuple
+        """
+        if field_ref is None:
+            groups = numpy.zeros(len(self.data[0]), dtype=numpy.dtype(int))
+        else:
+            _, groups = self.__get_data_groups__(field_ref)
+        ranks, counts = MyTCSV.__get_random_ranks__(groups, numpy.random.default_rng(seed))
+        test = ranks < numpy.round(counts * test_fraction).astype(int)[groups]
+        return numpy.flatnonzero(~test), numpy.flatnonzero(test)
+
+    def __get_data_groups__(self, field_ref):
+        """
+        Returns the sorted distinct values of the column @field_ref and, for each data row, the index
+        of its value. Columns are factorized once and cached until they are replaced (e.g. by fetch_data()
+        or iter_chunks()), so later groupings only sort integers.
+        :param field_ref: string or integer
+        :return: tuple
+        """
         field = self.resolve_field_ref(field_ref)
-        for i in range(len(self.data[field])):
-            key = self.data[field][i]
-            if key in result:
-                result[key] = numpy.append(result[key], i)
-            else:
-                result[key] = numpy.array([i])
-        return result
+        column = self.data[field]
+        cached = self.__data_groups__.get(field)
+        if cached is None or cached[0] is not column:
+            keys, groups = numpy.unique(column, return_inverse=True)
+            cached = self.__data_groups__[field] = (column, keys, groups.reshape(-1))
+        return cached[1], cached[2]
+
+    @staticmethod
+    def __get_random_ranks__(groups, rng):
+        """
+        Returns, for each row, its rank in a random permutation of the rows of its group, and the rows
+        count of each group.
+        :param groups: numpy.array
+        :param rng: numpy.random.Generator
+        :return: tuple
+        """
+        order = numpy.argsort(groups + rng.random(len(groups)))
+        counts = numpy.bincount(groups)
+        starts = numpy.cumsum(counts) - counts
+        ranks = numpy.empty(len(groups), dtype=numpy.dtype(int))
+        ranks[order] = numpy.arange(len(groups)) - starts[groups[order]]
+        return ranks, counts
 
     def close(self):
         self.data = None
@@ -317,13 +1264,15 @@ class Timeline(MyTCSV):
     TAG_DATE_FORMAT = 'date_format'
     TAG_DOY_FILE = 'doy_tif_filepath'
     TAG_DAY_FACTOR = 'doy_factor'
+    RESAMPLE_METHODS = ('linear', 'nearest', 'last')
 
-    def __init__(self, filename, date_format='%Y-%m-%d', doy_file='doy.tif', day_factor=1.0):
+    def __init__(self, filename, date_format='%Y-%m-%d', doy_file='doy.tif', day_factor=1.0, block_cache=None,
+                 pool=None, lazy=False, metadata_cache=False):
         super(Timeline, self).__init__(filename)
         self.tags[Timeline.TAG_DATE_FORMAT] = self.get_tag_value(Timeline.TAG_DATE_FORMAT, date_format)
         self.tags[Timeline.TAG_DOY_FILE] = self.get_tag_value(Timeline.TAG_DOY_FILE, doy_file)
         self.tags[Timeline.TAG_DAY_FACTOR] = self.get_tag_value(Timeline.TAG_DAY_FACTOR, day_factor)
-        self.doy_stack = Mygdal(self.tags[Timeline.TAG_DOY_FILE])
+        self.doy_stack = Mygdal(self.tags[Timeline.TAG_DOY_FILE], block_cache, pool, lazy, metadata_cache)
 
     def __transform_tag_value__(self, tag_name, tag_value):
         if tag_name == Timeline.TAG_DATE_FIELD:
@@ -343,18 +1292,159 @@ class Timeline(MyTCSV):
         super(Timeline, self).close()
 
     def read_pixel_dates(self, pixel):
-        doys = self.doy_stack.read_pixel_values(pixel)
-        mask_nodata = self.doy_stack.mask_nodata_pixel_bands(doys)
+        return self.doys_to_dates(self.doy_stack.read_pixel_values(pixel)).astype(datetime.datetime)
+
+    def read_pixels_dates(self, pixels, spatial_index=None):
+        """
+        Reads the dates of each pixel in @pixels using block-aligned reads of the DOY stack.
+        Returns a datetime64 array with shape (pixels, time) (see doys_to_dates()).
+        :param pixels: numpy.array
+        :param spatial_index: SpatialIndex
+        :return: numpy.array
+        """
+        return self.doys_to_dates(self.doy_stack.read_pixels_values(pixels, spatial_index))
+
+    @timed_stage('dates')
+    def doys_to_dates(self, doys, axis=-1):
+        """
+        Computes at once the dates of a DOY array whose @axis is the time line, e.g. a (pixels, time) block
+        or, with @axis 0, a (time, rows, cols) window. Each date is the year start of the time line date plus
+        DOY times doy_factor days, or the time line date itself where DOY is nodata.
+        Returns a datetime64 array with the same shape as @doys.
+        :param doys: numpy.array
+        :param axis: integer
+        :return: numpy.array
+        """
+        doys = numpy.moveaxis(numpy.asarray(doys), axis, -1)
         dates = self.data[self.tags[Timeline.TAG_DATE_FIELD]]
-        if len(doys) != len(dates):
-            raise Exception(__error_time_line_length__, __error_time_line_length_msg__ % (len(dates), len(doys)))
-        return numpy.array([datetime.datetime(dates[i].year, 1, 1) +
-                            datetime.timedelta(days=doys[i] * self.tags[Timeline.TAG_DAY_FACTOR])
-                            if mask_nodata[i] else dates[i] for i in range(len(dates))])
+        if doys.shape[-1] != len(dates):
+            raise Exception(__error_time_line_length__,
+                            __error_time_line_length_msg__ % (len(dates), doys.shape[-1]))
+        mask_nodata = self.doy_stack.mask_nodata_pixel_bands(doys)
+        days = numpy.asarray(numpy.where(mask_nodata, doys, 0) * self.tags[Timeline.TAG_DAY_FACTOR],
+                             dtype=numpy.float64)
+        offsets = numpy.rint(days * 86400e6).astype(numpy.dtype('timedelta64[us]'))
+        years = dates.astype(numpy.dtype('datetime64[Y]')).astype(dates.dtype)
+        return numpy.moveaxis(numpy.where(mask_nodata, years + offsets, dates), -1, axis)
+
+    def read_window_dates(self, x, y, xsize, ysize):
+        """
+        Reads the dates of every pixel in the given window of the DOY stack.
+        Returns a datetime64 array with shape (time, @ysize, @xsize) (see doys_to_dates()).
+        :param x: integer
+        :param y: integer
+        :param xsize: integer
+        :param ysize: integer
+        :return: numpy.array
+        """
+        return self.doys_to_dates(self.doy_stack.read_window_values(x, y, xsize, ysize), axis=0)
+
+    def iter_tile_dates(self, tile_size=None):
+        """
+        Iterates over the whole DOY stack tile by tile (see Mygdal.iter_windows()), yielding for each tile
+        its (x, y, xsize, ysize) window and its (time, rows, cols) dates array.
+        :param tile_size: integer or numpy.array
+        :return: generator
+        """
+        for window in self.doy_stack.iter_windows(tile_size):
+            yield window, self.read_window_dates(*window)
 
     @staticmethod
     def mask_timespan_dates(dates, date_from=None, date_to=None):
-        return (dates >= date_from) * (dates <= date_to)
+        """
+        Returns a mask of the @dates inside [@date_from, @date_to]. Bounds may be scalars or arrays with one
+        date per row of @dates (e.g. one per sample), and a None or NaT bound leaves that side open.
+        :param dates: numpy.array
+        :param date_from: numpy.datetime64 or numpy.array
+        :param date_to: numpy.datetime64 or numpy.array
+        :return: numpy.array
+        """
+        dates = numpy.asarray(dates, dtype=numpy.dtype('datetime64[us]'))
+        result = numpy.ones(dates.shape, dtype=bool)
+        for bound, compare in ((date_from, numpy.greater_equal), (date_to, numpy.less_equal)):
+            if bound is None:
+                continue
+            bound = numpy.asarray(bound, dtype=numpy.dtype('datetime64[us]'))
+            bound = numpy.reshape(bound, bound.shape + (1,) * (dates.ndim - bound.ndim))
+            result &= compare(dates, bound) | numpy.isnat(bound)
+        return result
+
+    @staticmethod
+    @timed_stage('resample')
+    def resample_values(values, mask, dates, grid_dates, method='linear', date_from=None, date_to=None):
+        """
+        Resamples at once the irregular time series of every sample and band onto the sorted @grid_dates.
+        @values and @mask are (samples, bands, time) arrays and @dates a (samples, time) datetime64 array,
+        as in a SamplesCube. Only valid values with a date are used, in date order. @method is 'linear'
+        (interpolation between the valid values around each grid date), 'nearest' (closest valid value) or
+        'last' (last valid value up to each grid date). If @date_from or @date_to are given (see
+        mask_timespan_dates()), values and grid dates out of each sample interval are left out.
+        Returns a float32 (samples, bands, grid) values array, NaN where no value could be resampled, and
+        its mask. All series are searched with one searchsorted over their flattened concatenation, each
+        one shifted by its row number times the dates span so they stay sorted.
+        :param values: numpy.array
+        :param mask: numpy.array
+        :param dates: numpy.array
+        :param grid_dates: numpy.array
+        :param method: string
+        :param date_from: numpy.datetime64 or numpy.array
+        :param date_to: numpy.datetime64 or numpy.array
+        :return: tuple
+        """
+        if method not in Timeline.RESAMPLE_METHODS:
+            raise Exception(__error_resample_method__, __error_resample_method_msg__ % (method,
+                                                                                        Timeline.RESAMPLE_METHODS))
+        grid_dates = numpy.asarray(grid_dates, dtype=numpy.dtype('datetime64[us]'))
+        dates = numpy.broadcast_to(numpy.asarray(dates, dtype=numpy.dtype('datetime64[us]'))[:, None, :],
+                                   values.shape)
+        mask = mask & ~numpy.isnat(dates) & Timeline.mask_timespan_dates(dates, date_from, date_to)
+        shape = values.shape[:-1] + grid_dates.shape
+        result = numpy.full(shape, numpy.nan, dtype=numpy.float32)
+        result_mask = numpy.zeros(shape, dtype=bool)
+        if not result.size or not values.shape[-1]:
+            return result, result_mask
+        rows, times = result.size // len(grid_dates), values.shape[-1]
+        origin = min(grid_dates.min(), dates[mask].min()) if mask.any() else grid_dates.min()
+        days = numpy.where(mask, (dates - origin) / numpy.timedelta64(1, 'D'), 0.0).reshape(rows, times)
+        grid_days = (grid_dates - origin) / numpy.timedelta64(1, 'D')
+        span = max(days.max(), grid_days.max()) + 2
+        mask = mask.reshape(rows, times)
+        order = numpy.argsort(numpy.where(mask, days, span - 1), axis=1, kind='stable')
+        days = numpy.where(numpy.take_along_axis(mask, order, axis=1), numpy.take_along_axis(days, order, axis=1),
+                           span - 1)
+        values = numpy.take_along_axis(values.reshape(rows, times), order, axis=1)
+        counts = numpy.count_nonzero(mask, axis=1)[:, None]
+        offsets = numpy.arange(rows)[:, None]
+        right = numpy.searchsorted((days + offsets * span).ravel(), (grid_days + offsets * span).ravel(),
+                                   side='right').reshape(rows, -1) - offsets * times
+        has_left = right > 0
+        has_right = right < counts
+        left = numpy.clip(right - 1, 0, times - 1)
+        right = numpy.clip(right, 0, times - 1)
+        days_left = numpy.take_along_axis(days, left, axis=1)
+        days_right = numpy.take_along_axis(days, right, axis=1)
+        values_left = numpy.take_along_axis(values, left, axis=1).astype(numpy.float64)
+        values_right = numpy.take_along_axis(values, right, axis=1).astype(numpy.float64)
+        if method == 'last':
+            valid = has_left
+            resampled = values_left
+        elif method == 'nearest':
+            use_right = has_right & (~has_left | (days_right - grid_days < grid_days - days_left))
+            valid = has_left | has_right
+            resampled = numpy.where(use_right, values_right, values_left)
+        else:
+            between = has_left & has_right
+            valid = between | (has_left & (days_left == grid_days))
+            numerator = numpy.where(between, grid_days - days_left, 0.0)
+            denominator = numpy.where(between, days_right - days_left, 1.0)
+            weights = numerator / denominator
+            resampled = values_left + weights * (values_right - values_left)
+        if date_from is not None or date_to is not None:
+            valid = valid & Timeline.mask_timespan_dates(numpy.broadcast_to(grid_dates, shape), date_from,
+                                                         date_to).reshape(rows, -1)
+        result.reshape(rows, -1)[valid] = resampled[valid]
+        result_mask.reshape(rows, -1)[...] = valid
+        return result, result_mask
 
 
 class Samples(MyTCSV):
@@ -369,16 +1459,27 @@ class Samples(MyTCSV):
     TAG_BANDS_PATHS = 'bands_filepaths'
     TAG_BANDS_FACTORS = 'bands_factors'
 
-    def __init__(self, filename, date_format='%Y-%m-%d', timeline_file='timeline.csv', bands_files='ndvi.tif,evi.tif'):
+    def __init__(self, filename, date_format='%Y-%m-%d', timeline_file='timeline.csv', bands_files='ndvi.tif,evi.tif',
+                 block_cache=None, use_vrt=False, pool=None, lazy=False, metadata_cache=False):
         super(Samples, self).__init__(filename)
         self.tags[Samples.TAG_DATE_FORMAT] = self.get_tag_value(Samples.TAG_DATE_FORMAT, date_format)
         self.tags[Samples.TAG_TIMELINE_FILE] = self.get_tag_value(Samples.TAG_TIMELINE_FILE, timeline_file)
         self.tags[Samples.TAG_BANDS_PATHS] = self.get_tag_value(Samples.TAG_BANDS_PATHS, bands_files)
-        self.timeline = Timeline(self.tags[Samples.TAG_TIMELINE_FILE])
-        self.bands = [Mygdal(value) for value in self.tags[Samples.TAG_BANDS_PATHS]]
+        self.block_cache = block_cache
+        self.__spatial_index__ = None
+        self.pool = pool
+        self.timeline = Timeline(self.tags[Samples.TAG_TIMELINE_FILE], block_cache=block_cache, pool=pool, lazy=lazy,
+                                 metadata_cache=metadata_cache)
+        self.bands = [Mygdal(value, block_cache, pool, lazy, metadata_cache)
+                      for value in self.tags[Samples.TAG_BANDS_PATHS]]
         self.bands_factor = [value for value in self.tags[Samples.TAG_BANDS_FACTORS]]
         if len(self.bands) != len(self.bands_factor):
             raise Exception(__error_bands_tags__, __error_bands_tags_msg__)
+        for band in self.bands:
+            band.set_grid_reference(self.timeline.doy_stack)
+        self.stacks = None
+        if use_vrt:
+            self.stacks = MygdalStacks([self.timeline.doy_stack] + self.bands, block_cache)
 
     def __transform_tag_value__(self, tag_name, tag_value):
         if tag_name == Samples.TAG_X_FIELD:
@@ -414,7 +1515,14 @@ class Samples(MyTCSV):
         self.timeline.fetch_data()
         super(Samples, self).fetch_data()
 
+    def iter_chunks(self, n):
+        if not len(self.timeline.data):
+            self.timeline.fetch_data()
+        return super(Samples, self).iter_chunks(n)
+
     def close(self):
+        if self.stacks is not None:
+            self.stacks.close_dataset()
         for value in self.bands:
             value.close_dataset()
         self.timeline.close()
@@ -433,14 +1541,362 @@ class Samples(MyTCSV):
                                                    self.tags[Samples.TAG_PROJ_WKT])
         return result
 
-    def get_samples_timeseries(self, samples_index=None, filter_sample_interval=False):
-        result = []
-        samples_pixels = self.timeline.doy_stack.geolocs_to_pixels(self.reproject_samples_to(self.timeline.doy_stack,
-                                                                                             samples_index))
-        for i in range(len(samples_pixels)):
+    def read_samples_dates_interval(self, samples_index=None):
+        """
+        Returns the from and to dates of each sample in @samples_index (all samples if None).
+        :param samples_index: list
+        :return: tuple
+        """
+        dates_from = self.data[self.tags[Samples.TAG_FROM_DT_FIELD]]
+        dates_to = self.data[self.tags[Samples.TAG_TO_DT_FIELD]]
+        if samples_index is not None:
+            return dates_from[samples_index], dates_to[samples_index]
+        return dates_from, dates_to
+
+    def read_samples_pixels(self, samples_index=None):
+        """
+        Returns the DOY stack pixels of each sample in @samples_index (all samples if None).
+        :param samples_index: list
+        :return: numpy.array
+        """
+        return self.timeline.doy_stack.geolocs_to_pixels(self.reproject_samples_to(self.timeline.doy_stack,
+                                                                                   samples_index))
+
+    def get_spatial_index(self):
+        """
+        Returns a spatial index over the DOY stack pixels of all samples. The index is built once
+        for the loaded data and rebuilt whenever data member changes (e.g. in iter_chunks()).
+        :return: SpatialIndex
+        """
+        if self.__spatial_index__ is None or self.__spatial_index__[0] is not self.data:
+            self.__spatial_index__ = (self.data, self.timeline.doy_stack.get_spatial_index(self.read_samples_pixels()))
+        return self.__spatial_index__[1]
+
+    def query_samples_window(self, x, y, xsize, ysize):
+        """
+        Returns the sorted indexes of the samples inside the given DOY stack window,
+        e.g. one yielded by Mygdal.iter_windows().
+        :param x: integer
+        :param y: integer
+        :param xsize: integer
+        :param ysize: integer
+        :return: numpy.array
+        """
+        return self.get_spatial_index().query_bbox(ord_pair(x, y), ord_pair(x + xsize, y + ysize))
+
+    def query_samples_radius(self, pixel, radius):
+        """
+        Returns the sorted indexes of the samples within @radius pixels from @pixel in the DOY stack.
+        :param pixel: numpy.array
+        :param radius: float
+        :return: numpy.array
+        """
+        return self.get_spatial_index().query_radius(pixel, radius)
+
+    def get_random_valid_pixels(self, n=1, bbox_ul=None, bbox_lr=None, seed=None, all_bands=True,
+                                pixels_per_block=1, batch_size=65536, max_draws=None):
+        """
+        Draws @n random DOY stack pixels holding data in the DOY stack and in every band stack, e.g. as
+        background samples (see Mygdal.get_random_valid_pixels()).
+        :param n: integer
+        :param bbox_ul: numpy.array
+        :param bbox_lr: numpy.array
+        :param seed: integer or numpy.random.Generator
+        :param all_bands: bool
+        :param pixels_per_block: integer
+        :param batch_size: integer
+        :param max_draws: integer
+        :return: numpy.array
+        """
+        return self.timeline.doy_stack.get_random_valid_pixels(n, bbox_ul, bbox_lr, seed, self.bands, all_bands,
+                                                               pixels_per_block, batch_size, max_draws)
+
+    def read_pixels_stacks(self, pixels, workers=None):
+        """
+        Reads the dates and every band stack values of each pixel in @pixels using block-aligned reads.
+        If @workers is greater than 1, pixels are split in spatial shards (see get_spatial_shards()) that
+        are read by a pool of processes, each one opening its own datasets from timeline_filepath and
+        bands_filepaths tags. Results are merged back in @pixels order, so they do not depend on @workers.
+        Otherwise, if the samples were opened with use_vrt, all stacks are read at once through their VRT.
+        Returns a tuple with a (pixels, time) dates array and a list of (pixels, time) values arrays per band.
+        :param pixels: numpy.array
+        :param workers: integer
+        :return: tuple
+        """
+        spatial_index = self.timeline.doy_stack.get_spatial_index(pixels)
+        if (not workers or workers < 2 or len(pixels) < 2) and self.stacks is not None:
+            doys, *values = self.stacks.read_pixels_stacks(pixels, spatial_index)
+            return self.timeline.doys_to_dates(doys), values
+        if not workers or workers < 2 or len(pixels) < 2:
+            return (self.timeline.read_pixels_dates(pixels, spatial_index),
+                    [band.read_pixels_values(pixels, spatial_index) for band in self.bands])
+        shards = get_spatial_shards(spatial_index, workers * 4)
+        with multiprocessing.Pool(workers, __init_stacks_worker__,
+                                  (self.tags[Samples.TAG_TIMELINE_FILE], self.tags[Samples.TAG_BANDS_PATHS])) as pool:
+            shards_stacks = pool.map(__read_stacks_worker__, [pixels[shard] for shard in shards])
+        dates = numpy.empty((len(pixels), shards_stacks[0][0].shape[1]), dtype=shards_stacks[0][0].dtype)
+        values = [numpy.empty((len(pixels), value.shape[1]), dtype=value.dtype) for value in shards_stacks[0][1]]
+        for shard, (shard_dates, shard_values) in zip(shards, shards_stacks):
+            dates[shard] = shard_dates
+            for j in range(len(values)):
+                values[j][shard] = shard_values[j]
+        return dates, values
+
+    def iter_pixels_stacks(self, pixels, threads=4, queue_depth=2, batch_size=4096):
+        """
+        Reads every stack values of @pixels in a pipeline: pixels are split in spatial batches of about
+        @batch_size pixels (see get_spatial_shards()) and a pool of @threads reads up to @queue_depth batches
+        ahead from the DOY stack and every band stack (or their VRT), while the caller processes the current
+        one. GDAL releases the GIL while reading, so I/O overlaps with computing.
+        Yields for each batch its pixels indexes and a list of (pixels, time) values arrays, the DOY stack first.
+        :param pixels: numpy.array
+        :param threads: integer
+        :param queue_depth: integer
+        :param batch_size: integer
+        :return: generator
+        """
+        stacks = [self.stacks] if self.stacks is not None else [self.timeline.doy_stack] + self.bands
+        batches = get_spatial_shards(self.timeline.doy_stack.get_spatial_index(pixels),
+                                     max(1, -(-len(pixels) // batch_size)))
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            pending = collections.deque()
+            for i in range(len(batches) + queue_depth + 1):
+                if i < len(batches):
+                    pending.append((batches[i], [executor.submit(stack.read_pixels_values, pixels[batches[i]])
+                                                 for stack in stacks]))
+                if pending and (len(pending) > queue_depth or i >= len(batches)):
+                    batch, futures = pending.popleft()
+                    values = [future.result() for future in futures]
+                    if self.stacks is not None:
+                        values = self.stacks.split_stacks(values[0], 1)
+                    yield batch, values
+
+    def iter_samples_stacks(self, samples_index=None, workers=None, cache_file=None, threads=None, queue_depth=2):
+        """
+        Iterates over the dates and every band stack values of each sample in @samples_index (all samples
+        if None) by batches. With @threads, batches come from the read-ahead pipeline of iter_pixels_stacks()
+        and their dates are computed while the next ones are read. Otherwise there is a single batch read by
+        read_samples_stacks(). Yields for each batch its rows in @samples_index, a (rows, time) dates array
+        and a list of (rows, time) values arrays per band.
+        :param samples_index: list
+        :param workers: integer
+        :param cache_file: string
+        :param threads: integer
+        :param queue_depth: integer
+        :return: generator
+        """
+        if not threads or workers or cache_file is not None:
+            dates, values = self.read_samples_stacks(samples_index, workers, cache_file)
+            yield numpy.arange(len(dates)), dates, values
+            return
+        for rows, values in self.iter_pixels_stacks(self.read_samples_pixels(samples_index), threads, queue_depth):
+            yield rows, self.timeline.doys_to_dates(values[0]), values[1:]
+
+    def read_samples_stacks(self, samples_index=None, workers=None, cache_file=None):
+        """
+        Reads the dates and every band stack values of each sample in @samples_index (all samples if None),
+        as read_pixels_stacks() does. If @cache_file is given, all samples are read through that persistent
+        cache (see __read_cached_stacks__()) and then selected.
+        :param samples_index: list
+        :param workers: integer
+        :param cache_file: string
+        :return: tuple
+        """
+        if cache_file is None:
+            return self.read_pixels_stacks(self.read_samples_pixels(samples_index), workers)
+        dates, values = self.__read_cached_stacks__(cache_file, workers)
+        if samples_index is not None:
+            return dates[samples_index], [band_values[samples_index] for band_values in values]
+        return dates, values
+
+    def __read_cached_stacks__(self, cache_file, workers):
+        """
+        Reads all samples stacks through the .npz @cache_file, extracting only what the cache is missing, and
+        refreshes it. Cached samples are reused while the time line file, the DOY stack and the samples projection
+        are unchanged, as long as their coordinates match the loaded ones, so samples appended to the file are the
+        only ones extracted. Cached bands are reused while their file is unchanged (see get_file_key()), so only
+        new or modified bands are extracted for cached samples.
+        """
+        timeline_key = numpy.array([get_file_key(self.tags[Samples.TAG_TIMELINE_FILE]),
+                                    get_file_key(self.timeline.tags[Timeline.TAG_DOY_FILE]),
+                                    self.tags[Samples.TAG_PROJ_WKT]])
+        bands_keys = numpy.array([get_file_key(value) for value in self.tags[Samples.TAG_BANDS_PATHS]])
+        geolocs = self.read_samples_geolocs()
+        cached_rows = 0
+        cached_dates = None
+        cached_bands = {}
+        if os.path.isfile(cache_file):
+            with numpy.load(cache_file) as cache:
+                if numpy.array_equal(cache['timeline_key'], timeline_key):
+                    cached_geolocs = cache['geolocs'][:len(geolocs)]
+                    mismatches = numpy.flatnonzero(numpy.any(cached_geolocs != geolocs[:len(cached_geolocs)], axis=1))
+                    cached_rows = mismatches[0] if len(mismatches) else len(cached_geolocs)
+                    cached_dates = cache['dates'][:cached_rows]
+                    cached_bands = {key: cache['band_%d' % i][:cached_rows]
+                                    for i, key in enumerate(cache['bands_keys']) if key in bands_keys}
+        if not cached_rows:
+            cached_bands = {}
+        missing_bands = [j for j in range(len(self.bands)) if bands_keys[j] not in cached_bands]
+        if cached_rows and missing_bands:
+            pixels = self.read_samples_pixels(numpy.arange(cached_rows))
+            spatial_index = self.timeline.doy_stack.get_spatial_index(pixels)
+            for j in missing_bands:
+                cached_bands[bands_keys[j]] = self.bands[j].read_pixels_values(pixels, spatial_index)
+        dates = cached_dates
+        values = [cached_bands.get(key) for key in bands_keys]
+        if cached_rows < len(geolocs):
+            new_dates, new_values = self.read_pixels_stacks(
+                self.read_samples_pixels(numpy.arange(cached_rows, len(geolocs))), workers)
+            if cached_rows:
+                dates = numpy.concatenate((dates, new_dates))
+                values = [numpy.concatenate((values[j], new_values[j])) for j in range(len(values))]
+            else:
+                dates, values = new_dates, new_values
+        if cached_rows < len(geolocs) or missing_bands:
+            arrays = {'band_%d' % j: values[j] for j in range(len(values))}
+            with open(cache_file + '.tmp', 'wb') as file:
+                numpy.savez(file, timeline_key=timeline_key, bands_keys=bands_keys, geolocs=geolocs, dates=dates,
+                            **arrays)
+            os.replace(cache_file + '.tmp', cache_file)
+        return dates, values
+
+    def get_samples_timeseries(self, samples_index=None, filter_sample_interval=False, batched=True,
+                               as_datetime64=False, workers=None, cache_file=None, threads=None, queue_depth=2):
+        """
+        Extracts the time series of each sample in @samples_index (all samples if None) from every band stack.
+        Returns a list with one entry per sample, each one a list of [values, dates] pairs per band.
+        If @batched is True, pixels are read block by block from each stack (see Mygdal.read_pixels_values())
+        instead of one read per sample, and dates and masks are computed for all samples at once. This gives
+        the same result with much less I/O. Dates are datetime objects unless @as_datetime64 is True.
+        Batched reads may be spread over @workers processes (see read_pixels_stacks()), go through the
+        persistent @cache_file if given (see read_samples_stacks()) or be pipelined by a pool of @threads
+        reading up to @queue_depth batches ahead (see iter_pixels_stacks()).
+        :param samples_index: list
+        :param filter_sample_interval: bool
+        :param batched: bool
+        :param as_datetime64: bool
+        :param workers: integer
+        :param cache_file: string
+        :param threads: integer
+        :param queue_depth: integer
+        :return: list
+        """
+        if not batched:
+            return self.__get_pixels_timeseries__(self.read_samples_pixels(samples_index), samples_index,
+                                                  filter_sample_interval)
+        result = [None] * (len(self.data[self.tags[Samples.TAG_X_FIELD]]) if samples_index is None
+                           else len(samples_index))
+        for rows, samples_dates, samples_values in self.iter_samples_stacks(samples_index, workers, cache_file,
+                                                                            threads, queue_depth):
+            mask_dates = numpy.ones(samples_dates.shape, dtype=bool)
+            if filter_sample_interval:
+                mask_dates = Timeline.mask_timespan_dates(
+                    samples_dates, *self.read_samples_dates_interval(self.__select_samples__(samples_index, rows)))
+            samples_masks = [band.mask_nodata_pixel_bands(values) & mask_dates
+                             for band, values in zip(self.bands, samples_values)]
+            if not as_datetime64:
+                samples_dates = samples_dates.astype(datetime.datetime)
+            for i in range(len(rows)):
+                result[rows[i]] = [[samples_values[j][i][samples_masks[j][i]] * self.bands_factor[j],
+                                    samples_dates[i][samples_masks[j][i]]] for j in range(len(self.bands))]
+        return result
+
+    @staticmethod
+    def __select_samples__(samples_index, rows):
+        if samples_index is None:
+            return rows
+        return numpy.asarray(samples_index)[rows]
+
+    def get_samples_cube(self, samples_index=None, filter_sample_interval=False, group_field=None, workers=None,
+                         cache_file=None, threads=None, queue_depth=2, grid_dates=None, resample_method='linear'):
+        """
+        Extracts the time series of each sample in @samples_index (all samples if None) as a dense SamplesCube
+        instead of the nested lists returned by get_samples_timeseries(). Nodata values and, if
+        @filter_sample_interval is True, dates out of each sample interval are False in the cube mask.
+        If @group_field is given, samples are ordered by its keys (see get_data_key_indexes()), keeping their
+        order and repetitions in @samples_index within each key, so each key can be sliced from the cube
+        without copying. Reads are made as in get_samples_timeseries().
+        If @grid_dates is given, the cube is resampled onto them with @resample_method (see
+        SamplesCube.resample()), grid dates out of each sample interval being masked if @filter_sample_interval.
+        :param samples_index: list
+        :param filter_sample_interval: bool
+        :param group_field: string or integer
+        :param workers: integer
+        :param cache_file: string
+        :param threads: integer
+        :param queue_depth: integer
+        :param grid_dates: numpy.array
+        :param resample_method: string
+        :return: SamplesCube
+        """
+        groups = None
+        if samples_index is None:
+            samples_index = numpy.arange(len(self.data[self.tags[Samples.TAG_X_FIELD]]))
+        samples_index = numpy.array(samples_index, dtype=numpy.dtype(int))
+        if group_field is not None:
+            keys, codes = self.__get_data_groups__(group_field)
+            appearance = numpy.argsort(numpy.unique(codes, return_index=True)[1])
+            ranks = numpy.empty(len(keys), dtype=numpy.dtype(int))
+            ranks[appearance] = numpy.arange(len(keys))
+            keys = keys[appearance]
+            samples_ranks = ranks[codes[samples_index]]
+            samples_index = samples_index[numpy.argsort(samples_ranks, kind='stable')]
+            counts = numpy.bincount(samples_ranks, minlength=len(keys))
+            ends = numpy.cumsum(counts)
+            groups = {keys[i]: slice(int(ends[i] - counts[i]), int(ends[i])) for i in numpy.flatnonzero(counts)}
+        timeline_dates = self.timeline.data[self.timeline.tags[Timeline.TAG_DATE_FIELD]]
+        cube = numpy.empty((len(samples_index), len(self.bands), len(timeline_dates)), dtype=numpy.float32)
+        mask = numpy.empty(cube.shape, dtype=bool)
+        dates = numpy.empty((len(samples_index), len(timeline_dates)), dtype=timeline_dates.dtype)
+        for rows, rows_dates, values in self.iter_samples_stacks(samples_index, workers, cache_file, threads,
+                                                                 queue_depth):
+            dates[rows] = rows_dates
+            for j in range(len(self.bands)):
+                cube[rows, j] = values[j]
+                cube[rows, j] *= self.bands_factor[j]
+                mask[rows, j] = self.bands[j].mask_nodata_pixel_bands(values[j])
+            if filter_sample_interval:
+                mask[rows] &= Timeline.mask_timespan_dates(
+                    rows_dates, *self.read_samples_dates_interval(samples_index[rows]))[:, None, :]
+        result = SamplesCube(cube, mask, dates, samples_index, groups)
+        if grid_dates is not None:
+            interval = self.read_samples_dates_interval(samples_index) if filter_sample_interval else ()
+            result = result.resample(grid_dates, resample_method, *interval)
+        return result
+
+    def iter_tile_timeseries(self, tile_size=None):
+        """
+        Iterates over every pixel of the images tile by tile (see Mygdal.iter_windows()), reading each stack
+        once per tile, so memory is bounded by @tile_size instead of the image size. For each tile yields
+        a tuple with its (x, y, xsize, ysize) window, a (bands, time, rows, cols) array of raw values
+        (bands_factors are not applied), the (time, rows, cols) datetime64 dates derived from the DOY stack
+        and a (bands, time, rows, cols) mask which is False where values are nodata.
+        :param tile_size: integer or numpy.array
+        :return: generator
+        """
+        for window in self.timeline.doy_stack.iter_windows(tile_size):
+            if self.stacks is not None:
+                doys, *values = self.stacks.read_window_stacks(*window)
+            else:
+                doys = self.timeline.doy_stack.read_window_values(*window)
+                values = [band.read_window_values(*window) for band in self.bands]
+            dates = self.timeline.doys_to_dates(doys, axis=0)
+            values = numpy.stack(values)
+            masks = numpy.stack([band.mask_nodata_window_bands(band_values)
+                                 for band, band_values in zip(self.bands, values)])
+            yield window, values, dates, masks
+
+    def __get_pixels_timeseries__(self, samples_pixels, samples_index, filter_sample_interval):
+        """
+        Per pixel implementation of get_samples_timeseries(), reading each sample from each stack separately.
+        Samples are read in storage order (see SpatialIndex) and returned in @samples_pixels order.
+        """
+        result = [None] * len(samples_pixels)
+        for i in self.timeline.doy_stack.get_spatial_index(samples_pixels).order:
             pixel_timeseries = []
-            date_from = self.data[self.tags[Samples.TAG_FROM_DT_FIELD]][i]
-            date_to = self.data[self.tags[Samples.TAG_FROM_DT_FIELD]][i]
+            sample = i if samples_index is None else samples_index[i]
+            date_from = self.data[self.tags[Samples.TAG_FROM_DT_FIELD]][sample]
+            date_to = self.data[self.tags[Samples.TAG_TO_DT_FIELD]][sample]
             pixel_dates = self.timeline.read_pixel_dates(samples_pixels[i])
             for j in range(len(self.bands)):
                 pixel_values = self.bands[j].read_pixel_values(samples_pixels[i])
@@ -454,5 +1910,35 @@ class Samples(MyTCSV):
                     elif date_to:
                         mask *= pixel_dates <= date_to
                 pixel_timeseries.append([pixel_values[mask] * self.bands_factor[j], pixel_dates[mask]])
-            result.append(pixel_timeseries)
+            result[i] = pixel_timeseries
         return result
+
+
+def get_spatial_shards(spatial_index, n):
+    """
+    Splits the pixels of @spatial_index in at most @n spatial shards of similar size. Shards follow
+    the index storage order and are cut at buckets boundaries, so no block is shared between shards.
+    Returns a list of pixels indexes arrays.
+    :param spatial_index: SpatialIndex
+    :param n: integer
+    :return: list
+    """
+    starts = spatial_index.buckets_start[1:]
+    cuts = starts[numpy.searchsorted(starts, numpy.arange(1, n) * len(spatial_index) / n)
+                  .clip(0, len(starts) - 1)] if len(starts) else []
+    return [shard for shard in numpy.split(spatial_index.order, numpy.unique(cuts)) if len(shard)]
+
+
+__worker_stacks__ = None
+
+
+def __init_stacks_worker__(timeline_file, bands_files):
+    global __worker_stacks__
+    timeline = Timeline(timeline_file)
+    timeline.fetch_data()
+    __worker_stacks__ = (timeline, [Mygdal(value) for value in bands_files])
+
+
+def __read_stacks_worker__(pixels):
+    timeline, bands = __worker_stacks__
+    return timeline.read_pixels_dates(pixels), [band.read_pixels_values(pixels) for band in bands]